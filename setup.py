@@ -442,6 +442,23 @@ namespace opencl {
             # opts.append(cpp_flag(self.compiler))
             if has_flag(self.compiler, '-fvisibility=hidden'):
                 opts.append('-fvisibility=hidden')
+            if has_flag(self.compiler, '-fvisibility-inlines-hidden'):
+                opts.append('-fvisibility-inlines-hidden')
+
+            # Place each function/data in its own section, so the linker can discard the unused template instantiations.
+            if has_flag(self.compiler, '-ffunction-sections') and has_flag(self.compiler, '-fdata-sections'):
+                opts.append('-ffunction-sections')
+                opts.append('-fdata-sections')
+                if sys.platform == 'darwin':
+                    link_opts.append('-Wl,-dead_strip')
+                else:
+                    link_opts.append('-Wl,--gc-sections')
+
+            # Optimization flags for the numeric kernels. -ffast-math is not used because it implies
+            # -ffinite-math-only, and some code checks for NaN results (e.g. std::isnan in UCV.cpp).
+            for flag in ['-O3', '-fno-math-errno', '-fno-trapping-math', '-funroll-loops']:
+                if has_flag(self.compiler, flag):
+                    opts.append(flag)
 
         for ext in self.extensions:
             ext.extra_compile_args.extend(opts)
@@ -454,6 +471,11 @@ namespace opencl {
                 ext.extra_link_args.append("-Wl,-rpath,@loader_path/../pyarrow")
                 ext.extra_link_args.append("-Wl,-rpath," + pa.get_library_dirs()[0])
 
+        # Compile the source files of the extension in parallel. By default, it uses all the available cores. The number
+        # of jobs can be set with the NPY_NUM_BUILD_JOBS environment variable.
+        from pybind11.setup_helpers import ParallelCompile
+        ParallelCompile("NPY_NUM_BUILD_JOBS").install()
+
         build_ext.build_extensions(self)
 
         # Copy the pyarrow dlls because Windows do not have the concept of RPATH.
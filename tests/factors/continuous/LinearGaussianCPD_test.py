@@ -4,6 +4,7 @@ import pyarrow as pa
 import pybnesian as pbn
 
 import pytest
+from scipy.linalg import solve
 from scipy.stats import norm
 
 import util_test
@@ -24,11 +25,20 @@ def test_lg_evidence():
 
 
 def fit_numpy(_df, variable, evidence):
-    df_na = _df.loc[:, [variable] + evidence].dropna()
-    linregress_data = np.column_stack((np.ones(df_na.shape[0]), df_na.loc[:, evidence]))
-    (beta, res, _, _) = np.linalg.lstsq(linregress_data, df_na.loc[:, variable], rcond=None)
+    npdata = _df.loc[:, [variable] + evidence].to_numpy()
+    nan_rows = np.any(np.isnan(npdata), axis=1)
+    npdata_no_null = npdata[~nan_rows, :]
+
+    linregress_data = np.vstack((np.ones(npdata_no_null.shape[0]), npdata_no_null[:, 1:].T)).T
+    y = npdata_no_null[:, 0]
+
+    # Solve the normal equations with a Cholesky factorization instead of the SVD used by np.linalg.lstsq.
+    XtX = linregress_data.T @ linregress_data
+    Xty = linregress_data.T @ y
+    beta = solve(XtX, Xty, assume_a='pos')
+    res = y @ y - beta @ Xty
     
-    return beta, res / (df_na.count()[variable] - len(evidence) - 1)
+    return beta, res / (npdata_no_null.shape[0] - len(evidence) - 1)
 
 def test_lg_data_type():
     cpd = pbn.LinearGaussianCPD("a", [])
@@ -53,11 +63,12 @@ def test_lg_fit_null():
     c_null = np.random.randint(0, SIZE, size=100)
     d_null = np.random.randint(0, SIZE, size=100)
 
-    df_null = df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
+    null_data = df.to_numpy(copy=True)
+    null_data[a_null, 0] = np.nan
+    null_data[b_null, 1] = np.nan
+    null_data[c_null, 2] = np.nan
+    null_data[d_null, 3] = np.nan
+    df_null = pd.DataFrame(null_data, columns=df.columns)
 
     for variable, evidence in [("a", []), ("b", ["a"]), ("c", ["a", "b"]), ("d", ["a", "b", "c"])]:
         cpd = pbn.LinearGaussianCPD(variable, evidence)
@@ -128,11 +139,12 @@ def test_lg_logl_null():
     c_null = np.random.randint(0, 5000, size=100)
     d_null = np.random.randint(0, 5000, size=100)
 
-    df_null = test_df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
+    null_data = test_df.to_numpy(copy=True)
+    null_data[a_null, 0] = np.nan
+    null_data[b_null, 1] = np.nan
+    null_data[c_null, 2] = np.nan
+    null_data[d_null, 3] = np.nan
+    df_null = pd.DataFrame(null_data, columns=test_df.columns)
 
     for variable, evidence in [('a', []), ('b', ['a']), ('c', ['a', 'b']), ('d', ['a', 'b', 'c'])]:
         cpd = pbn.LinearGaussianCPD(variable, evidence)
@@ -185,11 +197,12 @@ def test_lg_slogl_null():
     c_null = np.random.randint(0, 5000, size=100)
     d_null = np.random.randint(0, 5000, size=100)
 
-    df_null = test_df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
+    null_data = test_df.to_numpy(copy=True)
+    null_data[a_null, 0] = np.nan
+    null_data[b_null, 1] = np.nan
+    null_data[c_null, 2] = np.nan
+    null_data[d_null, 3] = np.nan
+    df_null = pd.DataFrame(null_data, columns=test_df.columns)
 
     for variable, evidence in [('a', []), ('b', ['a']), ('c', ['a', 'b']), ('d', ['a', 'b', 'c'])]:
         cpd = pbn.LinearGaussianCPD(variable, evidence)
@@ -238,11 +251,12 @@ def test_lg_cdf_null():
     c_null = np.random.randint(0, 5000, size=100)
     d_null = np.random.randint(0, 5000, size=100)
 
-    df_null = test_df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
+    null_data = test_df.to_numpy(copy=True)
+    null_data[a_null, 0] = np.nan
+    null_data[b_null, 1] = np.nan
+    null_data[c_null, 2] = np.nan
+    null_data[d_null, 3] = np.nan
+    df_null = pd.DataFrame(null_data, columns=test_df.columns)
 
     for variable, evidence in [('a', []), ('b', ['a']), ('c', ['a', 'b']), ('d', ['a', 'b', 'c'])]:
         cpd = pbn.LinearGaussianCPD(variable, evidence)
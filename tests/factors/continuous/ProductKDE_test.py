@@ -1,18 +1,62 @@
 import pytest
 import numpy as np
+import pandas as pd
 import pyarrow as pa
 import pybnesian as pbn
 from pybnesian import BandwidthSelector
-from scipy.stats import gaussian_kde
+from scipy.special import logsumexp
 from functools import reduce
 
 import util_test
 
 SIZE = 500
-df = util_test.generate_normal_data(SIZE, seed=0)
-df_float = df.astype('float32')
 
-def test_check_type():
+@pytest.fixture(scope='module')
+def df():
+    return util_test.generate_normal_data(SIZE, seed=0)
+
+@pytest.fixture(scope='module')
+def df_float(df):
+    return df.astype('float32')
+
+@pytest.fixture(scope='module')
+def df_numpy(df):
+    return df.to_numpy()
+
+@pytest.fixture(scope='module')
+def df_float_numpy(df_float):
+    return df_float.to_numpy()
+
+TEST_SIZE = 50
+
+@pytest.fixture(scope='module')
+def df_test():
+    return util_test.generate_normal_data(TEST_SIZE, seed=1)
+
+@pytest.fixture(scope='module')
+def df_test_float(df_test):
+    return df_test.astype('float32')
+
+@pytest.fixture(scope='module')
+def df_test_null(df_test):
+    np.random.seed(0)
+    a_null = np.random.randint(0, TEST_SIZE, size=10)
+    b_null = np.random.randint(0, TEST_SIZE, size=10)
+    c_null = np.random.randint(0, TEST_SIZE, size=10)
+    d_null = np.random.randint(0, TEST_SIZE, size=10)
+
+    null_data = df_test.to_numpy(copy=True)
+    null_data[a_null, 0] = np.nan
+    null_data[b_null, 1] = np.nan
+    null_data[c_null, 2] = np.nan
+    null_data[d_null, 3] = np.nan
+    return pd.DataFrame(null_data, columns=df_test.columns)
+
+@pytest.fixture(scope='module')
+def df_test_null_float(df_test_null):
+    return df_test_null.astype('float32')
+
+def test_check_type(df, df_float):
     cpd = pbn.ProductKDE(['a'])
     cpd.fit(df)
     with pytest.raises(ValueError) as ex:
@@ -52,7 +96,18 @@ def py_scott_bandwidth(df, variables):
 
     return np.power(N, -2 / (d + 4)) * var
 
-def test_productkde_bandwidth():
+# Log-density of a Gaussian KDE with diagonal bandwidth, i.e. a product of univariate Gaussian kernels.
+def py_productkde_logl(train_npdata, test_npdata, bandwidth):
+    N = train_npdata.shape[0]
+    d = bandwidth.shape[0]
+
+    diff = test_npdata[:, np.newaxis, :] - train_npdata[np.newaxis, :, :]
+    kernel_logl = -0.5 * np.sum(diff * diff / bandwidth, axis=2)
+    lognorm_const = -0.5 * d * np.log(2*np.pi) - 0.5 * np.log(bandwidth).sum() - np.log(N)
+
+    return logsumexp(kernel_logl, axis=1) + lognorm_const
+
+def test_productkde_bandwidth(df, df_float):
     # for variables in [['a'], ['b', 'a'], ['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
     for variables in [['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
         for instances in [50, 150, 500]:
@@ -87,7 +142,7 @@ class UnitaryBandwidth(BandwidthSelector):
     def diag_bandwidth(self, df, variables):
         return np.ones((len(variables),))
     
-def test_productkde_new_bandwidth():
+def test_productkde_new_bandwidth(df, df_float):
     kde = pbn.ProductKDE(["a"], UnitaryBandwidth())
     kde.fit(df)
     assert kde.bandwidth == np.ones((1,))
@@ -102,7 +157,7 @@ def test_productkde_new_bandwidth():
     kde.fit(df_float)
     assert np.all(kde.bandwidth == np.ones((4,)))
 
-def test_productkde_data_type():
+def test_productkde_data_type(df, df_float):
     k = pbn.ProductKDE(["a"])
 
     with pytest.raises(ValueError) as ex:
@@ -114,7 +169,7 @@ def test_productkde_data_type():
     k.fit(df_float)
     assert k.data_type() == pa.float32()
 
-def test_productkde_fit():
+def test_productkde_fit(df, df_float):
     def _test_productkde_fit_iter(variables, _df, instances):
         cpd = pbn.ProductKDE(variables)
         assert not cpd.fitted()
@@ -133,7 +188,7 @@ def test_productkde_fit():
             _test_productkde_fit_iter(variables, df, instances)
             _test_productkde_fit_iter(variables, df_float, instances)
 
-def test_productkde_fit_null():
+def test_productkde_fit_null(df, df_numpy):
     def _test_productkde_fit_null_iter(variables, _df, instances):
         cpd = pbn.ProductKDE(variables)
         assert not cpd.fitted()
@@ -159,207 +214,131 @@ def test_productkde_fit_null():
     c_null = np.random.randint(0, SIZE, size=100)
     d_null = np.random.randint(0, SIZE, size=100)
 
-    df_null = df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
-
-    df_null_float = df_float.copy()
-    df_null_float.loc[df_null_float.index[a_null], 'a'] = np.nan
-    df_null_float.loc[df_null_float.index[b_null], 'b'] = np.nan
-    df_null_float.loc[df_null_float.index[c_null], 'c'] = np.nan
-    df_null_float.loc[df_null_float.index[d_null], 'd'] = np.nan
+    null_data = df_numpy.copy()
+    null_data[a_null, 0] = np.nan
+    null_data[b_null, 1] = np.nan
+    null_data[c_null, 2] = np.nan
+    null_data[d_null, 3] = np.nan
+    df_null = pd.DataFrame(null_data, columns=df.columns)
+    df_null_float = df_null.astype('float32')
 
     for variables in [['a'], ['b', 'a'], ['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
         for instances in [50, 150, 500]:
             _test_productkde_fit_null_iter(variables, df_null, instances)
             _test_productkde_fit_null_iter(variables, df_null_float, instances)
 
-def test_productkde_logl():
-    def _test_productkde_logl_iter(variables, _df, _test_df):
+def test_productkde_logl(df, df_float, df_numpy, df_float_numpy, df_test, df_test_float):
+    def _test_productkde_logl_iter(variables, _df, _npdata, _test_df):
         cpd = pbn.ProductKDE(variables)
         cpd.fit(_df)
 
         logl = cpd.logl(_test_df)
 
-        npdata = _df.loc[:, variables].to_numpy()
-        final_scipy_kde = gaussian_kde(npdata.T)
-        final_scipy_kde.covariance = np.diag(cpd.bandwidth)
-        final_scipy_kde.inv_cov = np.diag(1. / cpd.bandwidth)
-        final_scipy_kde.log_det = cpd.bandwidth.shape[0] * np.log(2*np.pi) + np.log(cpd.bandwidth).sum()
-
+        npdata = _npdata[:, _df.columns.get_indexer(variables)]
         test_npdata = _test_df.loc[:, variables].to_numpy()
-        scipy = final_scipy_kde.logpdf(test_npdata.T)
+        py_logl = py_productkde_logl(npdata, test_npdata, cpd.bandwidth)
 
         if np.all(_df.dtypes == 'float32'):
-            assert np.all(np.isclose(logl, scipy, atol=0.0005))
+            assert np.all(np.isclose(logl, py_logl, atol=0.0005))
         else:
-            assert np.all(np.isclose(logl, scipy))
-
-    test_df = util_test.generate_normal_data(50, seed=1)
-    test_df_float = test_df.astype('float32')
+            assert np.all(np.isclose(logl, py_logl))
 
     for variables in [['a'], ['b', 'a'], ['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
-        _test_productkde_logl_iter(variables, df, test_df)
-        _test_productkde_logl_iter(variables, df_float, test_df_float)
+        _test_productkde_logl_iter(variables, df, df_numpy, df_test)
+        _test_productkde_logl_iter(variables, df_float, df_float_numpy, df_test_float)
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df)
-    assert np.all(np.isclose(cpd.logl(test_df), cpd2.logl(test_df))), "Order of evidence changes logl() result."
+    assert np.all(np.isclose(cpd.logl(df_test), cpd2.logl(df_test))), "Order of evidence changes logl() result."
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df_float)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df_float)
-    assert np.all(np.isclose(cpd.logl(test_df_float), cpd2.logl(test_df_float), atol=0.0005)), "Order of evidence changes logl() result."
+    assert np.all(np.isclose(cpd.logl(df_test_float), cpd2.logl(df_test_float), atol=0.0005)), "Order of evidence changes logl() result."
 
-def test_productkde_logl_null():
-    def _test_productkde_logl_null_iter(variables, _df, _test_df):
+def test_productkde_logl_null(df, df_float, df_numpy, df_float_numpy, df_test_null, df_test_null_float):
+    def _test_productkde_logl_null_iter(variables, _df, _npdata, _test_df):
         cpd = pbn.ProductKDE(variables)
         cpd.fit(_df)
 
         logl = cpd.logl(_test_df)
 
-        npdata = _df.loc[:, variables].to_numpy()
-        final_scipy_kde = gaussian_kde(npdata.T)
-        final_scipy_kde.covariance = np.diag(cpd.bandwidth)
-        final_scipy_kde.inv_cov = np.diag(1. / cpd.bandwidth)
-        final_scipy_kde.log_det = cpd.bandwidth.shape[0] * np.log(2*np.pi) + np.log(cpd.bandwidth).sum()
-
+        npdata = _npdata[:, _df.columns.get_indexer(variables)]
         test_npdata = _test_df.loc[:, variables].to_numpy()
-        scipy = final_scipy_kde.logpdf(test_npdata.T)
+        py_logl = py_productkde_logl(npdata, test_npdata, cpd.bandwidth)
 
         if npdata.dtype == "float32":
-            assert np.all(np.isclose(logl, scipy, atol=0.0005, equal_nan=True))
+            assert np.all(np.isclose(logl, py_logl, atol=0.0005, equal_nan=True))
         else:
-            assert np.all(np.isclose(logl, scipy, equal_nan=True))
-
-    TEST_SIZE = 50
-
-    test_df = util_test.generate_normal_data(TEST_SIZE, seed=1)
-    test_df_float = test_df.astype('float32')
-
-    np.random.seed(0)
-    a_null = np.random.randint(0, TEST_SIZE, size=10)
-    b_null = np.random.randint(0, TEST_SIZE, size=10)
-    c_null = np.random.randint(0, TEST_SIZE, size=10)
-    d_null = np.random.randint(0, TEST_SIZE, size=10)
-
-    df_null = test_df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
-
-    df_null_float = test_df_float.copy()
-    df_null_float.loc[df_null_float.index[a_null], 'a'] = np.nan
-    df_null_float.loc[df_null_float.index[b_null], 'b'] = np.nan
-    df_null_float.loc[df_null_float.index[c_null], 'c'] = np.nan
-    df_null_float.loc[df_null_float.index[d_null], 'd'] = np.nan
+            assert np.all(np.isclose(logl, py_logl, equal_nan=True))
 
     for variables in [['a'], ['b', 'a'], ['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
-        _test_productkde_logl_null_iter(variables, df, df_null)
-        _test_productkde_logl_null_iter(variables, df_float, df_null_float)
+        _test_productkde_logl_null_iter(variables, df, df_numpy, df_test_null)
+        _test_productkde_logl_null_iter(variables, df_float, df_float_numpy, df_test_null_float)
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df)
-    assert np.all(np.isclose(cpd.logl(df_null), cpd2.logl(df_null), equal_nan=True)), "Order of evidence changes logl() result."
+    assert np.all(np.isclose(cpd.logl(df_test_null), cpd2.logl(df_test_null), equal_nan=True)), "Order of evidence changes logl() result."
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df_float)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df_float)
-    assert np.all(np.isclose(cpd.logl(df_null_float), cpd2.logl(df_null_float), atol=0.0005, equal_nan=True)), "Order of evidence changes logl() result."
+    assert np.all(np.isclose(cpd.logl(df_test_null_float), cpd2.logl(df_test_null_float), atol=0.0005, equal_nan=True)), "Order of evidence changes logl() result."
 
-def test_productkde_slogl():
-    def _test_productkde_slogl_iter(variables, _df, _test_df):
+def test_productkde_slogl(df, df_float, df_numpy, df_float_numpy, df_test, df_test_float):
+    def _test_productkde_slogl_iter(variables, _df, _npdata, _test_df):
         cpd = pbn.ProductKDE(variables)
         cpd.fit(_df)
 
-        npdata = _df.loc[:, variables].to_numpy()
-        final_scipy_kde = gaussian_kde(npdata.T)
-        final_scipy_kde.covariance = np.diag(cpd.bandwidth)
-        final_scipy_kde.inv_cov = np.diag(1. / cpd.bandwidth)
-        final_scipy_kde.log_det = cpd.bandwidth.shape[0] * np.log(2*np.pi) + np.log(cpd.bandwidth).sum()
-
+        npdata = _npdata[:, _df.columns.get_indexer(variables)]
         test_npdata = _test_df.loc[:, variables].to_numpy()
-        assert np.all(np.isclose(cpd.slogl(_test_df), final_scipy_kde.logpdf(test_npdata.T).sum()))
-
-    test_df = util_test.generate_normal_data(50, seed=1)
-    test_df_float = test_df.astype('float32')
+        assert np.all(np.isclose(cpd.slogl(_test_df), py_productkde_logl(npdata, test_npdata, cpd.bandwidth).sum()))
 
     for variables in [['a'], ['b', 'a'], ['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
-        _test_productkde_slogl_iter(variables, df, test_df)
-        _test_productkde_slogl_iter(variables, df_float, test_df_float)
+        _test_productkde_slogl_iter(variables, df, df_numpy, df_test)
+        _test_productkde_slogl_iter(variables, df_float, df_float_numpy, df_test_float)
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df)
-    assert np.all(np.isclose(cpd.slogl(test_df), cpd2.slogl(test_df))), "Order of evidence changes slogl() result."
+    assert np.all(np.isclose(cpd.slogl(df_test), cpd2.slogl(df_test))), "Order of evidence changes slogl() result."
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df_float)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df_float)
-    assert np.all(np.isclose(cpd.slogl(test_df_float), cpd2.slogl(test_df_float), atol=0.0005)), "Order of evidence changes slogl() result."
+    assert np.all(np.isclose(cpd.slogl(df_test_float), cpd2.slogl(df_test_float), atol=0.0005)), "Order of evidence changes slogl() result."
 
 
-def test_productkde_slogl_null():
-    def _test_productkde_slogl_null_iter(variables, _df, _test_df):
+def test_productkde_slogl_null(df, df_float, df_numpy, df_float_numpy, df_test_null, df_test_null_float):
+    def _test_productkde_slogl_null_iter(variables, _df, _npdata, _test_df):
         cpd = pbn.ProductKDE(variables)
         cpd.fit(_df)
 
-        npdata = _df.loc[:, variables].to_numpy()
-        final_scipy_kde = gaussian_kde(npdata.T)
-        final_scipy_kde.covariance = np.diag(cpd.bandwidth)
-        final_scipy_kde.inv_cov = np.diag(1. / cpd.bandwidth)
-        final_scipy_kde.log_det = cpd.bandwidth.shape[0] * np.log(2*np.pi) + np.log(cpd.bandwidth).sum()
-
+        npdata = _npdata[:, _df.columns.get_indexer(variables)]
         test_npdata = _test_df.loc[:, variables].to_numpy()
-        assert np.all(np.isclose(cpd.slogl(_test_df), np.nansum(final_scipy_kde.logpdf(test_npdata.T))))
-
-    TEST_SIZE = 50
-
-    test_df = util_test.generate_normal_data(TEST_SIZE, seed=1)
-    test_df_float = test_df.astype('float32')
-
-    np.random.seed(0)
-    a_null = np.random.randint(0, TEST_SIZE, size=10)
-    b_null = np.random.randint(0, TEST_SIZE, size=10)
-    c_null = np.random.randint(0, TEST_SIZE, size=10)
-    d_null = np.random.randint(0, TEST_SIZE, size=10)
-
-    df_null = test_df.copy()
-    df_null.loc[df_null.index[a_null], 'a'] = np.nan
-    df_null.loc[df_null.index[b_null], 'b'] = np.nan
-    df_null.loc[df_null.index[c_null], 'c'] = np.nan
-    df_null.loc[df_null.index[d_null], 'd'] = np.nan
-
-    df_null_float = test_df_float.copy()
-    df_null_float.loc[df_null_float.index[a_null], 'a'] = np.nan
-    df_null_float.loc[df_null_float.index[b_null], 'b'] = np.nan
-    df_null_float.loc[df_null_float.index[c_null], 'c'] = np.nan
-    df_null_float.loc[df_null_float.index[d_null], 'd'] = np.nan
+        assert np.all(np.isclose(cpd.slogl(_test_df), np.nansum(py_productkde_logl(npdata, test_npdata, cpd.bandwidth))))
 
     for variables in [['a'], ['b', 'a'], ['c', 'a', 'b'], ['d', 'a', 'b', 'c']]:
-        _test_productkde_slogl_null_iter(variables, df, df_null)
-        _test_productkde_slogl_null_iter(variables, df_float, df_null_float)
+        _test_productkde_slogl_null_iter(variables, df, df_numpy, df_test_null)
+        _test_productkde_slogl_null_iter(variables, df_float, df_float_numpy, df_test_null_float)
 
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df)
-    assert np.all(np.isclose(cpd.slogl(df_null), cpd2.slogl(df_null))), "Order of evidence changes slogl() result."
+    assert np.all(np.isclose(cpd.slogl(df_test_null), cpd2.slogl(df_test_null))), "Order of evidence changes slogl() result."
 
     cpd = pbn.ProductKDE(['d', 'a', 'b', 'c'])
     cpd.fit(df_float)
     cpd2 = pbn.ProductKDE(['a', 'c', 'd', 'b'])
     cpd2.fit(df_float)
-    assert np.all(np.isclose(cpd.slogl(df_null_float), cpd2.slogl(df_null_float), atol=0.0005)), "Order of evidence changes slogl() result."
+    assert np.all(np.isclose(cpd.slogl(df_test_null_float), cpd2.slogl(df_test_null_float), atol=0.0005)), "Order of evidence changes slogl() result."